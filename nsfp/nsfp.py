@@ -6,6 +6,18 @@ from typing import List
 from .nsf_build import NSF_LIB, ffibuilder
 from .constants import *
 
+# expansion mask required by each channel, indexed by channel id
+_CHANNEL_EXPANSION = (
+    (NONE_MASK,) * CHANNEL_EXPANSIONAUDIOSTART
+    + (VRC6_MASK,) * (CHANNEL_VRC6SAW - CHANNEL_VRC6SQUARE1 + 1)
+    + (VRC7_MASK,) * (CHANNEL_VRC7FM6 - CHANNEL_VRC7FM1 + 1)
+    + (FDS_MASK,)
+    + (MMC5_MASK,) * (CHANNEL_MMC5DPCM - CHANNEL_MMC5SQUARE1 + 1)
+    + (N163_MASK,) * (CHANNEL_N163WAVE8 - CHANNEL_N163WAVE1 + 1)
+    + (S5B_MASK,) * (CHANNEL_S5BSQUARE3 - CHANNEL_S5BSQUARE1 + 1)
+)
+assert len(_CHANNEL_EXPANSION) == CHANNEL_COUNT
+
 
 class NSF:
     def __init__(self, filename, pattern_length=256, duration=120):
@@ -42,45 +54,15 @@ class NSF:
 
 
 class Channel:
-    @staticmethod
-    def namco_count(nsf: NSF, track: int) -> int:
-        """get the number of namco channels + 1 in a track"""
-        namco_count = 1
-        if nsf.expansion & N163_MASK != 0:
-            NSF_LIB.NsfSetTrack(nsf.file, track)
-            for i in range(nsf.frame_count):
-                playing = int(NSF_LIB.NsfRunFrame(nsf.file)) != 0
-                if playing:
-                    namco_count = max(
-                        namco_count,
-                        int(
-                            NSF_LIB.NsfGetState(
-                                nsf.file, CHANNEL_N163WAVE1, STATE_N163NUMCHANNELS, 0
-                            )
-                        ),
-                    )
-        return namco_count
-
     @staticmethod
     def is_active(channel_id: int, expansion: int, namco_count: int) -> bool:
-        if channel_id < CHANNEL_EXPANSIONAUDIOSTART:
+        assert 0 <= channel_id < CHANNEL_COUNT, f"Invalid channel id:  {channel_id}"
+        mask = _CHANNEL_EXPANSION[channel_id]
+        if mask == NONE_MASK:
             return True
-        if channel_id >= CHANNEL_VRC6SQUARE1 and channel_id <= CHANNEL_VRC6SAW:
-            return expansion & VRC6_MASK != 0
-        if channel_id >= CHANNEL_VRC7FM1 and channel_id <= CHANNEL_VRC7FM6:
-            return expansion & VRC7_MASK != 0
-        if channel_id == CHANNEL_FDSWAVE:
-            return expansion & FDS_MASK != 0
-        if channel_id >= CHANNEL_MMC5SQUARE1 and channel_id <= CHANNEL_MMC5DPCM:
-            return expansion & MMC5_MASK != 0
-        if channel_id >= CHANNEL_N163WAVE1 and channel_id <= CHANNEL_N163WAVE8:
-            return (
-                expansion & N163_MASK != 0
-                and channel_id - CHANNEL_N163WAVE1 < namco_count
-            )
-        if channel_id >= CHANNEL_S5BSQUARE1 and channel_id <= CHANNEL_S5BSQUARE3:
-            return expansion & S5B_MASK != 0
-        assert False, f"Invalid channel id:  {channel_id}"
+        if expansion & mask == 0:
+            return False
+        return mask != N163_MASK or channel_id - CHANNEL_N163WAVE1 < namco_count
 
     def __init__(self, channel_id):
         self.channel_id = channel_id
@@ -104,9 +86,8 @@ class Channel:
         self.instrument = None
 
 
-def make_channels(nsf: NSF, track: int) -> List[Channel]:
-    """create a list of channels for a track"""
-    namco_count = Channel.namco_count(nsf, track)
+def make_channels(nsf: NSF, namco_count: int) -> List[Channel]:
+    """create a list of channels for a track given its namco channel count"""
     return [
         Channel(i)
         for i in range(CHANNEL_COUNT)
@@ -123,12 +104,24 @@ class Song:
         self.name = ffibuilder.string(raw_name).decode("ascii")
         if len(self.name) == 0:
             self.name = f"Track {index}"
-        self.channels = {i: v for i, v in enumerate(make_channels(nsf, index))}
-        NSF_LIB.NsfSetTrack(nsf.file, index)
+
+        # run the track, tracking the number of namco channels + 1 as we go
+        has_n163 = nsf.expansion & N163_MASK != 0
+        namco_count = 1
+        run_frame = NSF_LIB.NsfRunFrame
+        get_state = NSF_LIB.NsfGetState
+        nsf_file = nsf.file
+        NSF_LIB.NsfSetTrack(nsf_file, index)
         for frame in range(self.num_frames):
-            play_called = NSF_LIB.NsfRunFrame(nsf.file) != 0
+            play_called = run_frame(nsf_file) != 0
             assert play_called or (
                 not play_called and frame < 1000
             ), "Too many frames before play called"
             if play_called:
-                pass
+                if has_n163:
+                    num_channels = get_state(
+                        nsf_file, CHANNEL_N163WAVE1, STATE_N163NUMCHANNELS, 0
+                    )
+                    if num_channels > namco_count:
+                        namco_count = num_channels
+        self.channels = make_channels(nsf, namco_count)